@@ -0,0 +1,250 @@
+"""Combined Claude + Codex usage for Waybar in a single process.
+
+Running claude-usage and codex-usage as two Waybar modules costs two
+interpreter start-ups, two cookie decrypts and two TLS handshakes per
+refresh. This entrypoint fetches the selected providers concurrently over
+one shared HTTP session, and can stay resident (--daemon) so later
+refreshes skip start-up entirely.
+
+    ai-usage all --waybar                # one merged module, polled by Waybar
+    ai-usage all --waybar --daemon       # one merged module, persistent process
+    ai-usage claude --waybar --daemon    # same output as claude-usage, persistent
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import signal
+import sys
+
+import claude
+import codex
+from common import CACHE_TTL, STALE_TTL, get_cached_or_fetch, open_session, print_json
+
+
+# ==================== Configuration ====================
+
+PROVIDERS = {
+    "claude": (claude, claude.fetch_claude_usage, "Claude"),
+    "codex": (codex, codex.fetch_codex_usage, "Codex"),
+}
+
+DAEMON_INTERVAL = 120  # Matches the interval in the Waybar config templates
+
+
+# ==================== Core Logic: Get Usage ====================
+
+class _LazySession:
+    """Open the shared AsyncSession on first use, so cache hits never load curl_cffi."""
+
+    def __init__(self) -> None:
+        self._session = None
+
+    def get(self):
+        if self._session is None:
+            self._session = open_session()
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def fetch_usage(
+    targets: list[str],
+    browsers: list[str] | None,
+    ttl: int,
+    session: _LazySession,
+) -> dict[str, dict | Exception]:
+    """Fetch usage for each target concurrently; failures are returned, not raised.
+
+    Each target still goes through get_cached_or_fetch (in a worker thread), so
+    the file cache, multi-instance coordination and stale fallback behave as in
+    the single-provider scripts. Only the network fetch runs back on the event
+    loop, where all targets share one session.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def fetch_on_loop(target: str) -> dict:
+        _module, fetcher, _name = PROVIDERS[target]
+        return await fetcher(browsers, session.get())
+
+    def cached_fetch(target: str) -> dict:
+        return get_cached_or_fetch(
+            target,
+            lambda: asyncio.run_coroutine_threadsafe(fetch_on_loop(target), loop).result(),
+            ttl=ttl,
+            stale_ttl=STALE_TTL,
+        )
+
+    results = await asyncio.gather(
+        *(asyncio.to_thread(cached_fetch, target) for target in targets),
+        return_exceptions=True,
+    )
+    return dict(zip(targets, results))
+
+
+# ==================== Output: CLI / Waybar ====================
+
+def build_waybar(results: dict[str, dict | Exception], args: argparse.Namespace) -> dict:
+    """Build one Waybar payload; several targets are merged into a single module."""
+    payloads = []
+    for target, result in results.items():
+        module, _fetcher, name = PROVIDERS[target]
+        if isinstance(result, Exception):
+            payload = module.build_waybar_error(result)
+        else:
+            payload = module.build_waybar(result, args.format, args.tooltip_format, args.show_5h)
+        payloads.append((name, payload))
+
+    if len(payloads) == 1:
+        return payloads[0][1]
+
+    return {
+        "text": " ".join(p["text"] for _, p in payloads),
+        "tooltip": "\n\n".join(f"{name}\n{p['tooltip']}" for name, p in payloads),
+        "class": [p["class"] for _, p in payloads],
+        "percentage": max(p.get("percentage", 0) for _, p in payloads),
+    }
+
+
+def print_cli(results: dict[str, dict | Exception]) -> bool:
+    """Print each target's CLI output; returns False if any fetch failed."""
+    ok = True
+    for target, result in results.items():
+        module, _fetcher, name = PROVIDERS[target]
+        print(f"===== {name} =====")
+        if isinstance(result, Exception):
+            print(f"[!] Critical Error: {result}", file=sys.stderr)
+            ok = False
+        else:
+            module.print_cli(result)
+    return ok
+
+
+async def run_once(targets: list[str], args: argparse.Namespace) -> dict[str, dict | Exception]:
+    session = _LazySession()
+    try:
+        return await fetch_usage(targets, args.browser, _ttl(args), session)
+    finally:
+        await session.close()
+
+
+async def run_daemon(targets: list[str], args: argparse.Namespace) -> None:
+    """Print one Waybar line per interval; SIGUSR1 refreshes immediately, bypassing the cache."""
+    session = _LazySession()
+    refresh = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, refresh.set)
+
+    try:
+        while True:
+            ttl = 0 if refresh.is_set() else _ttl(args)
+            refresh.clear()
+            try:
+                results = await fetch_usage(targets, args.browser, ttl, session)
+                print_json(build_waybar(results, args))
+            except Exception as e:
+                # Never exit: Waybar hides the module when the process dies
+                print_json({
+                    "text": "<span foreground='#ff5555'>AI Err</span>",
+                    "tooltip": f"Error:\n{e}",
+                    "class": "critical"
+                })
+
+            try:
+                await asyncio.wait_for(refresh.wait(), timeout=args.interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await session.close()
+
+
+def _ttl(args: argparse.Namespace) -> int:
+    return 0 if args.no_cache else args.cache_ttl
+
+
+# ==================== CLI Entry Point ====================
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="ai-usage",
+        description="Claude and Codex usage from a single process",
+    )
+    parser.add_argument(
+        "target",
+        choices=("claude", "codex", "all"),
+        help="Provider to report; 'all' merges Claude and Codex into one module",
+    )
+    parser.add_argument(
+        "--waybar",
+        action="store_true",
+        help="Output in JSON format for Waybar custom module",
+    )
+    parser.add_argument(
+        "--browser",
+        action="append",
+        help="Browser cookie source to try (repeatable). Example: --browser chromium",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        help="Custom format string for waybar text (same variables as claude-usage --format)",
+    )
+    parser.add_argument(
+        "--tooltip-format",
+        type=str,
+        help="Custom format string for tooltip. Uses same variables as --format.",
+    )
+    parser.add_argument(
+        "--show-5h",
+        action="store_true",
+        help="Always show 5-hour window data (instead of auto-switching to 7-day at 80%%)",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=CACHE_TTL,
+        help=f"Seconds to reuse the last fetched usage before calling the API again (default: {CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always fetch fresh usage instead of reading the cache",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and print one Waybar line per --interval (send SIGUSR1 to refresh now)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=DAEMON_INTERVAL,
+        help=f"Seconds between refreshes in --daemon mode (default: {DAEMON_INTERVAL})",
+    )
+    args = parser.parse_args()
+
+    targets = list(PROVIDERS) if args.target == "all" else [args.target]
+
+    if args.daemon:
+        if not args.waybar:
+            parser.error("--daemon requires --waybar")
+        try:
+            asyncio.run(run_daemon(targets, args))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    results = asyncio.run(run_once(targets, args))
+
+    if args.waybar:
+        print_json(build_waybar(results, args))
+        sys.exit(0)
+
+    if not print_cli(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,24 +3,52 @@ from __future__ import annotations
 import argparse
 import json
 import sys
+import time
 
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from curl_cffi import requests
+from common import format_eta, load_cookies, parse_window_full, parse_window_percent, format_output, get_cached_or_fetch, open_login_url, open_session, loads_json, print_json, invalidate_cookie_cache, CACHE_DIR, CLOUDFLARE_COOKIES, CACHE_TTL, COOKIE_CACHE_TTL, STALE_TTL, LOGIN_URLS
 
-from common import format_eta, load_cookies, parse_window_percent, format_output, get_cached_or_fetch, open_login_url, LOGIN_URLS
+
+if TYPE_CHECKING:
+    # curl_cffi is only imported once a fetch actually runs (see open_session)
+    from curl_cffi.requests import AsyncSession
 
 
 # ==================== Configuration ====================
 
 CLAUDE_DOMAIN = "claude.ai"
 
+# Cookies the usage request needs: org id, login session, Cloudflare clearance
+CLAUDE_COOKIES = ("lastActiveOrg", "sessionKey") + CLOUDFLARE_COOKIES
+
 BASE_HEADERS = {
     "Referer": "https://claude.ai/chats",
     "Origin": "https://claude.ai",
     "Accept": "application/json, text/plain, */*",
 }
 
+# The usage API usually accepts plain TLS once the session cookie is present.
+# Chrome impersonation is only used after a 403, and that is remembered for a
+# day via a marker file. Set True to always impersonate.
+IMPERSONATE_REQUIRED = False
+IMPERSONATE_MARKER = CACHE_DIR / "claude.impersonate"
+IMPERSONATE_MARKER_TTL = 86400
+
+# Default Waybar templates (same placeholders as --format)
+DEFAULT_TEXT_FMT = "{icon} {pct}% {time_icon} {reset}"
+DEFAULT_TEXT_PAUSE = "{icon} Pause"
+DEFAULT_TEXT_READY = "{icon} Ready"
+DEFAULT_TOOLTIP_FMT = (
+    "Window     Used    Reset\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "5-Hour     {5h_pct:>3}%    {5h_reset}\n"
+    "7-Day      {7d_pct:>3}%    {7d_reset}\n"
+    "\n"
+    "Click to Refresh"
+)
+
 # SVG icon path (unused in current version)
 SCRIPT_DIR = Path(__file__).parent
 ICON_PATH = SCRIPT_DIR / "assets" / "claude.svg"
@@ -28,15 +56,50 @@ ICON_PATH = SCRIPT_DIR / "assets" / "claude.svg"
 
 # ==================== Core Logic: Get Usage ====================
 
-def _fetch_claude_usage_uncached(browsers: list[str] | None = None) -> dict:
-    """Internal function to fetch Claude usage data without caching"""
+def _impersonation_needed() -> bool:
+    if IMPERSONATE_REQUIRED:
+        return True
+    try:
+        return time.time() - IMPERSONATE_MARKER.stat().st_mtime < IMPERSONATE_MARKER_TTL
+    except OSError:
+        return False
+
+
+def _remember_impersonation() -> None:
     try:
-        cookies, _browser = load_cookies(CLAUDE_DOMAIN, browsers)
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        IMPERSONATE_MARKER.touch()
+    except OSError:
+        pass
+
+
+async def fetch_claude_usage(
+    browsers: list[str] | None = None,
+    session: AsyncSession | None = None,
+) -> dict:
+    """Fetch Claude usage data without caching.
+
+    Pass a long-lived session to reuse its connection across calls; otherwise
+    a new one is opened and closed for this fetch.
+    """
+    import asyncio
+
+    if session is None:
+        async with open_session() as session:
+            return await fetch_claude_usage(browsers, session)
+
+    try:
+        # Keyring IPC and SQLite block; keep the loop free for other fetches
+        cookies, _browser = await asyncio.to_thread(
+            load_cookies, CLAUDE_DOMAIN, browsers,
+            cache_ttl=COOKIE_CACHE_TTL, allow=CLAUDE_COOKIES, required=("lastActiveOrg",),
+        )
     except Exception as e:
         raise RuntimeError(f"Failed to read cookies: {e}")
 
     org_id = cookies.get("lastActiveOrg")
     if not org_id:
+        invalidate_cookie_cache(CLAUDE_DOMAIN)
         raise RuntimeError(
             "Missing 'lastActiveOrg' in cookies.\n"
             "Please refresh Claude page in browser or switch Organization."
@@ -44,41 +107,73 @@ def _fetch_claude_usage_uncached(browsers: list[str] | None = None) -> dict:
 
     url = f"https://{CLAUDE_DOMAIN}/api/organizations/{org_id}/usage"
 
+    impersonate = "chrome" if _impersonation_needed() else None
+
     # Retry once (2 attempts total)
     last_error = None
     for attempt in range(2):
         try:
-            resp = requests.get(
+            resp = await session.get(
                 url,
                 cookies=cookies,
                 headers=BASE_HEADERS,
-                impersonate="chrome",
+                impersonate=impersonate,
                 timeout=10
             )
 
+            if resp.status_code == 403 and impersonate is None:
+                # Cloudflare wants a browser fingerprint; retry as Chrome
+                impersonate = "chrome"
+                resp = await session.get(
+                    url,
+                    cookies=cookies,
+                    headers=BASE_HEADERS,
+                    impersonate=impersonate,
+                    timeout=10
+                )
+                if resp.status_code != 403:
+                    # Only a fingerprint block clears this way; a real auth 403 doesn't
+                    _remember_impersonation()
+
+            if resp.status_code in (401, 403):
+                # Cached cookies may be stale; decrypt fresh ones next time
+                invalidate_cookie_cache(CLAUDE_DOMAIN)
+
             if resp.status_code == 403:
                 raise RuntimeError("403 Forbidden: Try updating browser_cookie3 or refresh the page in browser.")
 
             resp.raise_for_status()
-            return resp.json()
+            return loads_json(resp.content)
 
         except Exception as e:
             last_error = e
-            if attempt == 0:  # First failure, retry
+            if attempt == 0:  # First failure, yield to the loop and retry
+                await asyncio.sleep(0)
                 continue
 
     # Both attempts failed
     raise RuntimeError(f"Request failed: {last_error}")
 
 
-def get_claude_usage(browsers: list[str] | None = None) -> dict:
+def get_claude_usage(browsers: list[str] | None = None, ttl: int = CACHE_TTL) -> dict:
     """
-    Fetch Claude usage data using curl_cffi to impersonate Chrome.
+    Fetch Claude usage data using curl_cffi (impersonating Chrome when needed).
 
     Uses file-based caching to prevent multiple Waybar instances (one per monitor)
-    from making concurrent API requests that might be rate-limited.
+    from making concurrent API requests that might be rate-limited. If a refresh
+    fails with a network error, a cached result up to STALE_TTL old is returned.
     """
-    return get_cached_or_fetch("claude", lambda: _fetch_claude_usage_uncached(browsers))
+    def fetch() -> dict:
+        import asyncio  # Only on a cache miss; a cached tick never loads it
+
+        return asyncio.run(fetch_claude_usage(browsers))
+
+    return get_cached_or_fetch(
+        "claude",
+        fetch,
+        ttl=ttl,
+        stale_ttl=STALE_TTL,
+    )
 
 
 # ==================== Output: CLI / Waybar ====================
@@ -100,17 +195,10 @@ def print_cli(usage: dict) -> None:
     print(f"7-day  : {sd.utilization:.1f}%  (Reset in {_fmt_reset(sd)})")
 
 
-def print_waybar(usage: dict, format_str: str | None = None, tooltip_format: str | None = None, show_5h: bool = False) -> None:
-    fh = parse_window_percent(usage.get("five_hour"))
-    sd = parse_window_percent(usage.get("seven_day"))
-
-    # Get raw window data to check for unused state
-    fh_raw = usage.get("five_hour") or {}
-    sd_raw = usage.get("seven_day") or {}
-
-    # Prepare all data points without icons
-    fh_reset_str = format_eta(fh.resets_at) if fh.resets_at else "Not started"
-    sd_reset_str = format_eta(sd.resets_at) if sd.resets_at else "Not started"
+def build_waybar(usage: dict, format_str: str | None = None, tooltip_format: str | None = None, show_5h: bool = False) -> dict:
+    """Build the Waybar JSON payload for Claude usage."""
+    fh = parse_window_full(usage.get("five_hour"), 5 * 60 * 60)
+    sd = parse_window_full(usage.get("seven_day"), 7 * 24 * 60 * 60)
 
     # Icons with colors (users can customize)
     icon_styled = "<span foreground='#DE7356' size='large'>󰜡</span>"
@@ -120,102 +208,58 @@ def print_waybar(usage: dict, format_str: str | None = None, tooltip_format: str
     if show_5h:
         # Always show 5-hour window
         target = fh
-        target_raw = fh_raw
         win_name = "5h"
-        window_length = 18000  # 5 hours in seconds
     elif sd.utilization >= 100:
         # 7-day window exhausted
         target = sd
-        target_raw = sd_raw
         win_name = "7d"
-        window_length = 604800
     elif sd.utilization > 80:
         # 7-day window high usage
         target = sd
-        target_raw = sd_raw
         win_name = "7d"
-        window_length = 604800  # 7 days in seconds
     else:
         # Default to 5h window
         target = fh
-        target_raw = fh_raw
         win_name = "5h"
-        window_length = 18000  # 5 hours in seconds
 
-    pct = int(round(target.utilization))
+    pct = target.utilization_pct
 
     window_not_started = (target.utilization == 0 and target.resets_at is None)
 
-    # Check if window is unused (utilization == 0 and reset time near window length)
-    is_unused = False
-    if target.utilization == 0 and target.resets_at:
-        from datetime import datetime, timezone
-        try:
-            if isinstance(target.resets_at, str):
-                reset_at_str = target.resets_at
-                if reset_at_str.endswith('Z'):
-                    reset_at_str = reset_at_str[:-1] + '+00:00'
-                reset_dt = datetime.fromisoformat(reset_at_str)
-            else:
-                reset_dt = datetime.fromtimestamp(target.resets_at, tz=timezone.utc)
-
-            now = datetime.now(timezone.utc)
-            reset_after = int((reset_dt - now).total_seconds())
-
-            # If reset time is close to window length (allow 1s error), consider it unused
-            is_unused = (reset_after >= window_length - 1)
-        except Exception:
-            pass
-
     # Determine status
     if sd.utilization >= 100:
         status = "Pause"
-    elif is_unused or window_not_started:
+    elif target.is_unused or window_not_started:
         status = "Ready"
     else:
         status = ""
 
     # Prepare data dictionary for formatting
     data = {
-        "5h_pct": int(round(fh.utilization)),
-        "7d_pct": int(round(sd.utilization)),
-        "5h_reset": fh_reset_str,
-        "7d_reset": sd_reset_str,
+        "5h_pct": fh.utilization_pct,
+        "7d_pct": sd.utilization_pct,
+        "5h_reset": fh.reset_str,
+        "7d_reset": sd.reset_str,
         "icon": icon_styled,
         "icon_plain": "󰜡",
         "time_icon": time_icon_styled,
         "time_icon_plain": "󰔚",
         "status": status,
         "pct": pct,
-        "reset": format_eta(target.resets_at) if target.resets_at else "Not started",
+        "reset": target.reset_str,
         "win": win_name,
     }
 
     # Use custom format or default
-    if format_str:
-        text = format_output(format_str, data)
-    else:
-        # Default format (backward compatible)
+    if not format_str:
         if status == "Pause":
-            text = f"{icon_styled} Pause"
+            format_str = DEFAULT_TEXT_PAUSE
         elif status == "Ready":
-            text = f"{icon_styled} Ready"
+            format_str = DEFAULT_TEXT_READY
         else:
-            text = f"{icon_styled} {pct}% {time_icon_styled} {data['reset']}"
-
-    # Use custom tooltip format or default
-    if tooltip_format:
-        tooltip = format_output(tooltip_format, data)
-    else:
-        # Default tooltip
-        tooltip = (
-            "Window     Used    Reset\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            f"5-Hour     {fh.utilization:>3.0f}%    {fh_reset_str}\n"
-            f"7-Day      {sd.utilization:>3.0f}%    {sd_reset_str}\n"
-            "\n"
-            "Click to Refresh"
-        )
+            format_str = DEFAULT_TEXT_FMT
+    text = format_output(format_str, data)
+    tooltip = format_output(tooltip_format or DEFAULT_TOOLTIP_FMT, data)
 
     if pct < 50:
         cls = "claude-low"
@@ -232,7 +276,37 @@ def print_waybar(usage: dict, format_str: str | None = None, tooltip_format: str
         "percentage": data["5h_pct"] if show_5h else data["pct"],
     }
 
-    print(json.dumps(output))
+    return output
+
+
+def print_waybar(
+    usage: dict,
+    format_str: str | None = None,
+    tooltip_format: str | None = None,
+    show_5h: bool = False,
+) -> None:
+    print_json(build_waybar(usage, format_str, tooltip_format, show_5h))
+
+
+def build_waybar_error(error: Exception) -> dict:
+    """Build the Waybar payload for a failed fetch.
+
+    HTTP auth errors also open the login page (with cooldown).
+    """
+    err_msg = str(error)
+    err_lower = err_msg.lower()
+    is_http_auth = "403" in err_msg or "401" in err_msg
+    is_cookie = "cookie" in err_lower
+    short_err = "Auth Err" if (is_http_auth or is_cookie) else "Net Err"
+    tooltip = f"Error fetching Claude usage:\n{err_msg}"
+    if is_http_auth:
+        if open_login_url(LOGIN_URLS["claude.ai"]):
+            tooltip += "\n\nOpened login page — log in then click to refresh"
+    return {
+        "text": f"<span foreground='#ff5555'>󰜡 {short_err}</span>",
+        "tooltip": tooltip,
+        "class": "critical"
+    }
 
 
 # ==================== CLI Entry Point ====================
@@ -268,26 +342,24 @@ def main() -> None:
         action="store_true",
         help="Always show 5-hour window data (instead of auto-switching to 7-day at 80%%)",
     )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=CACHE_TTL,
+        help=f"Seconds to reuse the last fetched usage before calling the API again (default: {CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always fetch fresh usage instead of reading the cache",
+    )
     args = parser.parse_args()
 
     try:
-        usage = get_claude_usage(args.browser)
+        usage = get_claude_usage(args.browser, ttl=0 if args.no_cache else args.cache_ttl)
     except Exception as e:
         if args.waybar:
-            err_msg = str(e)
-            err_lower = err_msg.lower()
-            is_http_auth = "403" in err_msg or "401" in err_msg
-            is_cookie = "cookie" in err_lower
-            short_err = "Auth Err" if (is_http_auth or is_cookie) else "Net Err"
-            tooltip = f"Error fetching Claude usage:\n{err_msg}"
-            if is_http_auth:
-                if open_login_url(LOGIN_URLS["claude.ai"]):
-                    tooltip += "\n\nOpened login page — log in then click to refresh"
-            print(json.dumps({
-                "text": f"<span foreground='#ff5555'>󰜡 {short_err}</span>",
-                "tooltip": tooltip,
-                "class": "critical"
-            }))
+            print_json(build_waybar_error(e))
             sys.exit(0)
         else:
             print(f"[!] Critical Error: {e}", file=sys.stderr)
@@ -4,14 +4,32 @@ import argparse
 import json
 import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from curl_cffi import requests
+from common import format_eta, load_cookies, parse_window_direct, parse_window_full, format_output, get_cached_or_fetch, open_login_url, open_session, loads_json, print_json, invalidate_cookie_cache, CLOUDFLARE_COOKIES, CACHE_TTL, COOKIE_CACHE_TTL, STALE_TTL, LOGIN_URLS
 
-from common import format_eta, load_cookies, parse_window_direct, format_output, get_cached_or_fetch, open_login_url, LOGIN_URLS
+
+if TYPE_CHECKING:
+    # curl_cffi is only imported once a fetch actually runs (see open_session)
+    from curl_cffi.requests import AsyncSession
 
 
 # ================= Configuration =================
 
+CHATGPT_DOMAIN = "chatgpt.com"
+
+# Cookies the session endpoint needs: next-auth session (possibly chunked as
+# .0/.1), device/account ids, Cloudflare clearance
+CHATGPT_COOKIES = (
+    "__Secure-next-auth.",
+    "__Host-next-auth.",
+    "oai-",
+    "_puid",
+) + CLOUDFLARE_COOKIES
+
+# Present only while logged in; without it the cookies are not worth caching
+SESSION_COOKIE = "__Secure-next-auth.session-token"
+
 BASE_HEADERS = {
     "Referer": "https://chatgpt.com/",
     "Origin": "https://chatgpt.com",
@@ -21,16 +39,46 @@ BASE_HEADERS = {
 SESSION_URL = "https://chatgpt.com/api/auth/session"
 CODEX_USAGE_URL = "https://chatgpt.com/backend-api/wham/usage"
 
+# Default Waybar templates (same placeholders as --format)
+DEFAULT_TEXT_FMT = "{icon} {pct}% {time_icon} {reset}"
+DEFAULT_TEXT_PAUSE = "{icon} Pause"
+DEFAULT_TEXT_READY = "{icon} Ready"
+DEFAULT_TOOLTIP_FMT = (
+    "Window     Used    Reset\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "5-Hour     {5h_pct:>3}%    {5h_reset}\n"
+    "7-Day      {7d_pct:>3}%    {7d_reset}\n"
+    "\n"
+    "Click to Refresh"
+)
+
 # SVG icon path (unused in current version)
 SCRIPT_DIR = Path(__file__).parent
 ICON_PATH = SCRIPT_DIR / "assets" / "codex.svg"
 
 # ================= Network Logic =================
 
-def _fetch_codex_usage_uncached(browsers: list[str] | None = None) -> dict:
-    """Internal function to fetch Codex usage data without caching"""
+async def fetch_codex_usage(
+    browsers: list[str] | None = None,
+    session: AsyncSession | None = None,
+) -> dict:
+    """Fetch Codex usage data without caching.
+
+    Both round-trips (session token, then usage) go through the same session,
+    so the usage call rides the connection the token call opened.
+    """
+    import asyncio
+
+    if session is None:
+        async with open_session() as session:
+            return await fetch_codex_usage(browsers, session)
+
     try:
-        cookies_dict, browser = load_cookies("chatgpt.com", browsers)
+        # Keyring IPC and SQLite block; keep the loop free for other fetches
+        cookies_dict, browser = await asyncio.to_thread(
+            load_cookies, CHATGPT_DOMAIN, browsers,
+            cache_ttl=COOKIE_CACHE_TTL, allow=CHATGPT_COOKIES, required=(SESSION_COOKIE,),
+        )
     except Exception as e:
         raise RuntimeError(f"Failed to read browser cookies: {e}")
 
@@ -41,7 +89,7 @@ def _fetch_codex_usage_uncached(browsers: list[str] | None = None) -> dict:
     for attempt in range(2):
         try:
             # Get Access Token
-            session_resp = requests.get(
+            session_resp = await session.get(
                 SESSION_URL,
                 cookies=cookies_dict,
                 headers=BASE_HEADERS,
@@ -49,21 +97,27 @@ def _fetch_codex_usage_uncached(browsers: list[str] | None = None) -> dict:
                 timeout=10
             )
 
+            if session_resp.status_code in (401, 403):
+                # Cached cookies may be stale; decrypt fresh ones next time
+                invalidate_cookie_cache(CHATGPT_DOMAIN)
+
             if session_resp.status_code == 403:
                 raise RuntimeError("403 Forbidden: Cloudflare blocked, check IP or update browser_cookie3")
 
             session_resp.raise_for_status()
-            session_data = session_resp.json()
+            session_data = loads_json(session_resp.content)
 
             access_token = session_data.get("accessToken")
             if not access_token:
-                raise RuntimeError("accessToken not found in session response.")
+                # Expired next-auth session: 200 with an empty body, not a 401
+                invalidate_cookie_cache(CHATGPT_DOMAIN)
+                raise RuntimeError("401 Unauthorized: accessToken not found in session response, log in to ChatGPT again.")
 
             # Get Usage Data
             usage_headers = BASE_HEADERS.copy()
             usage_headers["Authorization"] = f"Bearer {access_token}"
 
-            usage_resp = requests.get(
+            usage_resp = await session.get(
                 CODEX_USAGE_URL,
                 cookies=cookies_dict,
                 headers=usage_headers,
@@ -72,36 +126,49 @@ def _fetch_codex_usage_uncached(browsers: list[str] | None = None) -> dict:
             )
 
             usage_resp.raise_for_status()
-            return usage_resp.json()
+            return loads_json(usage_resp.content)
 
         except Exception as e:
             last_error = e
-            if attempt == 0:  # First failure, retry
+            if attempt == 0:  # First failure, yield to the loop and retry
+                await asyncio.sleep(0)
                 continue
 
     # Both attempts failed
     raise RuntimeError(f"Request failed: {last_error}")
 
 
-def get_codex_usage(browsers: list[str] | None = None) -> dict:
+def get_codex_usage(browsers: list[str] | None = None, ttl: int = CACHE_TTL) -> dict:
     """
     Fetch ChatGPT Codex usage data.
 
     Uses file-based caching to prevent multiple Waybar instances (one per monitor)
-    from making concurrent API requests that might be rate-limited.
+    from making concurrent API requests that might be rate-limited. If a refresh
+    fails with a network error, a cached result up to STALE_TTL old is returned.
     """
-    return get_cached_or_fetch("codex", lambda: _fetch_codex_usage_uncached(browsers))
+    def fetch() -> dict:
+        import asyncio  # Only on a cache miss; a cached tick never loads it
+
+        return asyncio.run(fetch_codex_usage(browsers))
+
+    return get_cached_or_fetch(
+        "codex",
+        fetch,
+        ttl=ttl,
+        stale_ttl=STALE_TTL,
+    )
 
 
 # ================= Output Logic =================
 
 
-def print_waybar(
+def build_waybar(
     usage: dict,
     format_str: str | None = None,
     tooltip_format: str | None = None,
     show_5h: bool = False,
-) -> None:
+) -> dict:
+    """Build the Waybar JSON payload for Codex usage."""
     rate = usage.get("rate_limit") or {}
     windows = [
         rate.get("primary_window") or {},
@@ -117,12 +184,8 @@ def print_waybar(
         (w for w in windows if w.get("limit_window_seconds") == 7 * 24 * 60 * 60),
         {},
     )
-    p_win = parse_window_direct(p_raw)
-    s_win = parse_window_direct(s_raw)
-
-    # Prepare all data points without icons
-    p_reset_str = format_eta(p_win.resets_at) if p_win.resets_at else "Not started"
-    s_reset_str = format_eta(s_win.resets_at) if s_win.resets_at else "Not started"
+    p_win = parse_window_full(p_raw, 5 * 60 * 60, parse_window_direct, derive_remaining=False)
+    s_win = parse_window_full(s_raw, 7 * 24 * 60 * 60, parse_window_direct, derive_remaining=False)
 
     # Icons with colors (users can customize)
     icon_styled = "<span foreground='#74AA9C' size='large'>󰬫</span>"
@@ -132,88 +195,61 @@ def print_waybar(
     if show_5h:
         # Always show primary (5-hour) window
         target_win = p_win
-        target_raw = p_raw
         win_type = "Primary"
     elif s_win.utilization >= 100:
         # Secondary window exhausted
         target_win = s_win
-        target_raw = s_raw
         win_type = "Secondary"
     elif s_win.utilization > 80:
         # Secondary window high usage
         target_win = s_win
-        target_raw = s_raw
         win_type = "Secondary"
     elif not p_raw and s_raw:
         target_win = s_win
-        target_raw = s_raw
         win_type = "Secondary"
     else:
         # Default to Primary window
         target_win = p_win
-        target_raw = p_raw
         win_type = "Primary"
 
-    pct = int(round(target_win.utilization))
-
-    # Check if window is unused (used_percent == 0 and reset_after near window length)
-    used_pct = target_raw.get("used_percent", 0)
-    reset_after = target_raw.get("reset_after_seconds", 0)
-    window_length = target_raw.get("limit_window_seconds", 0)
-
-    is_unused = (used_pct == 0 and reset_after >= window_length - 1)
+    pct = target_win.utilization_pct
 
     window_not_started = (target_win.utilization == 0 and target_win.resets_at is None)
 
     # Determine status
     if s_win.utilization >= 100:
         status = "Pause"
-    elif is_unused or window_not_started:
+    elif target_win.is_unused or window_not_started:
         status = "Ready"
     else:
         status = ""
 
     # Prepare data dictionary for formatting
     data = {
-        "5h_pct": int(round(p_win.utilization)),
-        "7d_pct": int(round(s_win.utilization)),
-        "5h_reset": p_reset_str,
-        "7d_reset": s_reset_str,
+        "5h_pct": p_win.utilization_pct,
+        "7d_pct": s_win.utilization_pct,
+        "5h_reset": p_win.reset_str,
+        "7d_reset": s_win.reset_str,
         "icon": icon_styled,
         "icon_plain": "󰬫",
         "time_icon": time_icon_styled,
         "time_icon_plain": "󰔚",
         "status": status,
         "pct": pct,
-        "reset": format_eta(target_win.resets_at) if target_win.resets_at else "Not started",
+        "reset": target_win.reset_str,
         "win": win_type,
     }
 
     # Use custom format or default
-    if format_str:
-        text = format_output(format_str, data)
-    else:
-        # Default format (backward compatible)
+    if not format_str:
         if status == "Pause":
-            text = f"{icon_styled} Pause"
+            format_str = DEFAULT_TEXT_PAUSE
         elif status == "Ready":
-            text = f"{icon_styled} Ready"
+            format_str = DEFAULT_TEXT_READY
         else:
-            text = f"{icon_styled} {pct}% {time_icon_styled} {data['reset']}"
-
-    # Use custom tooltip format or default
-    if tooltip_format:
-        tooltip = format_output(tooltip_format, data)
-    else:
-        # Default tooltip
-        tooltip = (
-            "Window     Used    Reset\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            f"5-Hour     {p_win.utilization:>3.0f}%    {p_reset_str}\n"
-            f"7-Day      {s_win.utilization:>3.0f}%    {s_reset_str}\n"
-            "\n"
-            "Click to Refresh"
-        )
+            format_str = DEFAULT_TEXT_FMT
+    text = format_output(format_str, data)
+    tooltip = format_output(tooltip_format or DEFAULT_TOOLTIP_FMT, data)
 
     if pct < 50:
         cls = "codex-low"
@@ -230,7 +266,37 @@ def print_waybar(
         "percentage": data["pct"],
     }
 
-    print(json.dumps(output))
+    return output
+
+
+def print_waybar(
+    usage: dict,
+    format_str: str | None = None,
+    tooltip_format: str | None = None,
+    show_5h: bool = False,
+) -> None:
+    print_json(build_waybar(usage, format_str, tooltip_format, show_5h))
+
+
+def build_waybar_error(error: Exception) -> dict:
+    """Build the Waybar payload for a failed fetch.
+
+    HTTP auth errors also open the login page (with cooldown).
+    """
+    err_msg = str(error)
+    err_lower = err_msg.lower()
+    is_http_auth = "403" in err_msg or "401" in err_msg
+    is_cookie = "cookie" in err_lower
+    short_err = "Auth Err" if (is_http_auth or is_cookie) else "Net Err"
+    tooltip = f"Error:\n{err_msg}"
+    if is_http_auth:
+        if open_login_url(LOGIN_URLS["chatgpt.com"]):
+            tooltip += "\n\nOpened login page — log in then click to refresh"
+    return {
+        "text": f"<span foreground='#ff5555'>󰬫 {short_err}</span>",
+        "tooltip": tooltip,
+        "class": "critical"
+    }
 
 
 def print_cli(usage: dict) -> None:
@@ -281,26 +347,24 @@ def main() -> None:
         action="store_true",
         help="Always show 5-hour window data (instead of auto-switching to 7-day at 80%%)",
     )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=CACHE_TTL,
+        help=f"Seconds to reuse the last fetched usage before calling the API again (default: {CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always fetch fresh usage instead of reading the cache",
+    )
     args = parser.parse_args()
 
     try:
-        usage = get_codex_usage(args.browser)
+        usage = get_codex_usage(args.browser, ttl=0 if args.no_cache else args.cache_ttl)
     except Exception as e:
         if args.waybar:
-            err_msg = str(e)
-            err_lower = err_msg.lower()
-            is_http_auth = "403" in err_msg or "401" in err_msg
-            is_cookie = "cookie" in err_lower
-            short_err = "Auth Err" if (is_http_auth or is_cookie) else "Net Err"
-            tooltip = f"Error:\n{err_msg}"
-            if is_http_auth:
-                if open_login_url(LOGIN_URLS["chatgpt.com"]):
-                    tooltip += "\n\nOpened login page — log in then click to refresh"
-            print(json.dumps({
-                "text": f"<span foreground='#ff5555'>󰬫 {short_err}</span>",
-                "tooltip": tooltip,
-                "class": "critical"
-            }))
+            print_json(build_waybar_error(e))
             sys.exit(0)
         else:
             print(f"[!] Critical Error: {e}", file=sys.stderr)
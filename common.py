@@ -2,17 +2,34 @@
 from __future__ import annotations
 
 import configparser
+import functools
 import glob
 import json
 import os
+import re
+import sys
 import time
 from dataclasses import dataclass
-from datetime import datetime, timezone
 from pathlib import Path
-from typing import Callable, Iterable, Mapping, Optional
+from typing import TYPE_CHECKING, Callable, Iterable, Mapping, Optional
 
-import browser_cookie3
+try:
+    import orjson  # Optional: faster per-tick JSON encode/decode
+except ImportError:
+    orjson = None
 
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+
+# format_output conditionals: {?a&b}...{/} and {?var}...{/var}
+_MULTI_COND_RE = re.compile(r'\{\?([^}]+&[^}]+)\}(.*?)\{/\}', re.DOTALL)
+_SINGLE_COND_RE = re.compile(r'\{\?(\w+)\}(.*?)\{/\1\}', re.DOTALL)
+
+# Cloudflare bot-management cookies (cf_clearance, __cf_bm, _cfuvid)
+CLOUDFLARE_COOKIES = ("cf_", "__cf", "_cf")
+
+HELIUM_COOKIE_FILE = "~/.config/net.imput.helium/Default/Cookies"
 
 DEFAULT_BROWSERS = ("chrome", "chromium", "brave", "edge", "firefox", "helium")
 
@@ -25,6 +42,9 @@ LOGIN_URLS = {
 
 # Cache configuration
 CACHE_DIR = Path.home() / ".cache" / "waybar-ai-usage"
+_runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+COOKIE_CACHE_DIR = Path(_runtime_dir) / "waybar-ai-usage" if _runtime_dir else None
+COOKIE_CACHE_TTL = 300  # Reuse decrypted browser cookies for 5 minutes
 LOGIN_OPEN_COOLDOWN = 600  # Don't re-open the same login page within 10 minutes
 
 
@@ -49,12 +69,69 @@ def open_login_url(url: str) -> bool:
     except FileNotFoundError:
         return False
 CACHE_TTL = 60  # Cache valid for 60 seconds
+STALE_TTL = 600  # Serve cache up to 10 minutes old when a refresh fails
+KEEPALIVE_IDLE = 30  # Close pooled connections idle longer than 30 seconds
+
+
+def open_session():
+    """Create a curl_cffi AsyncSession that keeps connections alive between requests.
+
+    Requests made through one session share a TLS connection per host, so
+    follow-up calls to the same site skip the handshake. Idle connections are
+    dropped after KEEPALIVE_IDLE seconds.
+    """
+    from curl_cffi import CurlOpt
+    from curl_cffi.requests import AsyncSession
+
+    return AsyncSession(curl_options={CurlOpt.MAXAGE_CONN: KEEPALIVE_IDLE})
+
+
+def loads_json(raw: bytes | str):
+    """Decode JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def print_json(obj: dict) -> None:
+    """Print obj as a single JSON line, using orjson when it is installed."""
+    stdout = getattr(sys.stdout, "buffer", None)
+    if orjson is None or stdout is None:
+        print(json.dumps(obj), flush=True)
+        return
+    # Keep ordering with any earlier print() output on the text layer
+    sys.stdout.flush()
+    stdout.write(orjson.dumps(obj) + b"\n")
+    stdout.flush()
+
+
+def _read_cache(cache_file: Path) -> dict | None:
+    try:
+        return loads_json(cache_file.read_bytes())
+    except Exception:
+        return None
+
+
+def _write_cache(cache_file: Path, data: dict) -> None:
+    """Write cache atomically so concurrent readers never see a partial file."""
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        if orjson is not None:
+            tmp_file.write_bytes(orjson.dumps(data))
+        else:
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f)
+        os.replace(tmp_file, cache_file)
+    except Exception:
+        # Failed to save cache, but we have the data
+        tmp_file.unlink(missing_ok=True)
 
 
 def get_cached_or_fetch(
     cache_name: str,
     fetch_func: Callable[[], dict],
-    ttl: int = CACHE_TTL
+    ttl: int = CACHE_TTL,
+    stale_ttl: int = 0,
 ) -> dict:
     """
     Get data from cache if fresh, otherwise fetch and cache.
@@ -65,7 +142,10 @@ def get_cached_or_fetch(
     Args:
         cache_name: Name of cache file (e.g., "claude", "codex")
         fetch_func: Function to call to fetch fresh data
-        ttl: Cache time-to-live in seconds
+        ttl: Cache time-to-live in seconds; 0 or less always fetches
+        stale_ttl: If the fetch fails with a non-auth error (anything but
+            HTTP 401/403/404 or a cookie failure), fall back to a cached copy up
+            to this many seconds old instead of raising
 
     Returns:
         Cached or freshly fetched data
@@ -76,19 +156,16 @@ def get_cached_or_fetch(
     updating_file = CACHE_DIR / f"{cache_name}.updating"
 
     # Check if cache is fresh
-    if cache_file.exists():
+    if ttl > 0 and cache_file.exists():
         cache_age = time.time() - cache_file.stat().st_mtime
         if cache_age < ttl:
-            # Cache is fresh, use it
-            try:
-                with open(cache_file, 'r') as f:
-                    return json.load(f)
-            except Exception:
-                # Cache file corrupted, proceed to fetch
-                pass
+            # Cache is fresh, use it (a corrupted file falls through to fetch)
+            data = _read_cache(cache_file)
+            if data is not None:
+                return data
 
     # Check if another process is already updating
-    if updating_file.exists():
+    if ttl > 0 and updating_file.exists():
         update_age = time.time() - updating_file.stat().st_mtime
         # If update marker is older than 5 seconds, assume stale and proceed
         if update_age < 5:
@@ -98,11 +175,9 @@ def get_cached_or_fetch(
                 if cache_file.exists():
                     cache_age = time.time() - cache_file.stat().st_mtime
                     if cache_age < ttl + 10:  # Accept slightly older cache when waiting
-                        try:
-                            with open(cache_file, 'r') as f:
-                                return json.load(f)
-                        except Exception:
-                            pass
+                        data = _read_cache(cache_file)
+                        if data is not None:
+                            return data
 
     # Need to fetch fresh data
     # Create updating marker
@@ -113,16 +188,24 @@ def get_cached_or_fetch(
 
     try:
         # Fetch fresh data
-        data = fetch_func()
-
-        # Save to cache
         try:
-            with open(cache_file, 'w') as f:
-                json.dump(data, f)
-        except Exception:
-            # Failed to save cache, but we have the data
-            pass
-
+            data = fetch_func()
+        except Exception as e:
+            # Auth errors must surface so the widget can prompt a re-login.
+            # Provider contract "Auth Err": HTTP 401/403/404 or a cookie failure.
+            err_msg = str(e)
+            is_auth = (
+                any(code in err_msg for code in ("401", "403", "404"))
+                or "cookie" in err_msg.lower()
+            )
+            if stale_ttl > 0 and not is_auth and cache_file.exists():
+                if time.time() - cache_file.stat().st_mtime < stale_ttl:
+                    data = _read_cache(cache_file)
+                    if data is not None:
+                        return data
+            raise
+
+        _write_cache(cache_file, data)
         return data
 
     finally:
@@ -139,9 +222,10 @@ def helium(cookie_file=None, domain_name="", key_file=None):
     Helium is a Chromium-based browser, so we use the chromium loader
     with Helium's cookie file path.
     """
-    import os
+    import browser_cookie3
+
     if cookie_file is None:
-        cookie_file = os.path.expanduser("~/.config/net.imput.helium/Default/Cookies")
+        cookie_file = os.path.expanduser(HELIUM_COOKIE_FILE)
     return browser_cookie3.chromium(cookie_file=cookie_file, domain_name=domain_name, key_file=key_file)
 
 
@@ -152,6 +236,8 @@ def _firefox_xdg_fallback(domain: str):
     instead of ~/.mozilla. browser_cookie3 doesn't check this path, so we
     locate cookies.sqlite ourselves and pass it via cookie_file=.
     """
+    import browser_cookie3
+
     xdg_dir = os.path.expanduser("~/.config/mozilla/firefox")
     if not os.path.isdir(xdg_dir):
         return None
@@ -166,63 +252,211 @@ def _firefox_xdg_fallback(domain: str):
     return None
 
 
-def load_cookies(domain: str, browsers: Iterable[str] | None = None) -> tuple[dict, str]:
-    """Load cookies for a domain from the first available browser in order."""
-    browsers = list(browsers or DEFAULT_BROWSERS)
-    errors: list[str] = []
+def _jar_to_dict(cj, allow: tuple[str, ...] | None) -> dict:
+    if allow is None:
+        return {c.name: c.value for c in cj}
+    return {c.name: c.value for c in cj if c.name.startswith(allow)}
 
-    for name in browsers:
-        # First check if we have a local implementation (e.g., helium)
-        loader = globals().get(name)
-        if loader is None:
-            # Fall back to browser_cookie3
-            loader = getattr(browser_cookie3, name, None)
-        if loader is None:
-            errors.append(f"{name}: unsupported by browser_cookie3")
-            continue
 
-        try:
-            cj = loader(domain_name=domain)
-            cookies = {c.name: c.value for c in cj}
-        except Exception as exc:
-            # Workaround: browser_cookie3 doesn't check ~/.config/mozilla/firefox
-            # which is the default on newer distros following XDG Base Directory spec.
-            # See https://github.com/NihilDigit/waybar-ai-usage/issues/9
-            if name == "firefox":
-                cj = _firefox_xdg_fallback(domain)
-                if cj is not None:
-                    cookies = {c.name: c.value for c in cj}
-                    if cookies:
-                        return cookies, name
-            errors.append(f"{name}: {exc}")
-            continue
-
-        if cookies:
-            return cookies, name
-
-        # When no legacy profile directory exists at all, browser_cookie3
-        # raises and the except branch above catches it. It returns an empty
-        # jar instead when ~/.mozilla/firefox holds a readable profile that
-        # has no cookies for this domain — a stale legacy profile sitting
-        # next to the real XDG one. That case lands here, not in the except.
+def _probe_browser(name: str, domain: str, allow: tuple[str, ...] | None = None) -> dict:
+    """Load cookies for a domain from one browser, raising if none are found."""
+    import browser_cookie3
+
+    # With an allowlist, Chromium-based browsers can skip decrypting the
+    # rest of the jar. Falls back to browser_cookie3 on any error.
+    if allow is not None:
+        from fast_cookies import CHROMIUM_BROWSERS, load_chromium_cookies
+
+        if name in CHROMIUM_BROWSERS:
+            cookie_file = os.path.expanduser(HELIUM_COOKIE_FILE) if name == "helium" else None
+            cookies = load_chromium_cookies(name, domain, allow, cookie_file)
+            if cookies:
+                return cookies
+            raise RuntimeError("no cookies found")
+
+    # First check if we have a local implementation (e.g., helium)
+    loader = globals().get(name)
+    if loader is None:
+        # Fall back to browser_cookie3
+        loader = getattr(browser_cookie3, name, None)
+    if loader is None:
+        raise RuntimeError("unsupported by browser_cookie3")
+
+    try:
+        cj = loader(domain_name=domain)
+        cookies = _jar_to_dict(cj, allow)
+    except Exception:
+        # Workaround: browser_cookie3 doesn't check ~/.config/mozilla/firefox
+        # which is the default on newer distros following XDG Base Directory spec.
+        # See https://github.com/NihilDigit/waybar-ai-usage/issues/9
         if name == "firefox":
             cj = _firefox_xdg_fallback(domain)
             if cj is not None:
-                cookies = {c.name: c.value for c in cj}
+                cookies = _jar_to_dict(cj, allow)
                 if cookies:
-                    return cookies, name
+                    return cookies
+        raise
+
+    if cookies:
+        return cookies
+
+    # When no legacy profile directory exists at all, browser_cookie3
+    # raises and the except branch above catches it. It returns an empty
+    # jar instead when ~/.mozilla/firefox holds a readable profile that
+    # has no cookies for this domain — a stale legacy profile sitting
+    # next to the real XDG one. That case lands here, not in the except.
+    if name == "firefox":
+        cj = _firefox_xdg_fallback(domain)
+        if cj is not None:
+            cookies = _jar_to_dict(cj, allow)
+            if cookies:
+                return cookies
+
+    raise RuntimeError("no cookies found")
+
+
+# domain -> (loaded_at, cookies, browser) for the current process
+_COOKIE_MEMO: dict[str, tuple[float, dict, str]] = {}
+
+
+def _cookie_cache_file(domain: str) -> Path | None:
+    # Decrypted cookies only go to the per-user tmpfs, never to ~/.cache
+    if not COOKIE_CACHE_DIR:
+        return None
+    return COOKIE_CACHE_DIR / f"cookies-{domain}.json"
+
+
+def _read_cookie_cache(domain: str, browsers: list[str], ttl: int) -> tuple[dict, str] | None:
+    cache_file = _cookie_cache_file(domain)
+    if cache_file is None:
+        return None
+    try:
+        if time.time() - cache_file.stat().st_mtime >= ttl:
+            return None
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+        cookies, browser = cached["cookies"], cached["browser"]
+    except Exception:
+        return None
+    # Honour --browser: a hit from another browser doesn't count
+    if browsers and browser not in browsers:
+        return None
+    return cookies, browser
+
+
+def _write_cookie_cache(domain: str, cookies: dict, browser: str) -> None:
+    cache_file = _cookie_cache_file(domain)
+    if cache_file is None:
+        return
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        cache_file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"browser": browser, "cookies": cookies}, f)
+        os.replace(tmp_file, cache_file)
+    except Exception:
+        tmp_file.unlink(missing_ok=True)
+
+
+def invalidate_cookie_cache(domain: str) -> None:
+    """Drop cached cookies for a domain, e.g. after the API rejects them."""
+    _COOKIE_MEMO.pop(domain, None)
+    cache_file = _cookie_cache_file(domain)
+    if cache_file is not None:
+        cache_file.unlink(missing_ok=True)
+
+
+def _probe_in_background(name: str, domain: str, allow: tuple[str, ...] | None) -> Future:
+    """Run _probe_browser on a daemon thread so exit never waits on a losing probe."""
+    import threading
+    from concurrent.futures import Future
+
+    future = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(_probe_browser(name, domain, allow))
+        except Exception as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def load_cookies(
+    domain: str,
+    browsers: Iterable[str] | None = None,
+    cache_ttl: int = 0,
+    allow: Iterable[str] | None = None,
+    required: Iterable[str] = (),
+) -> tuple[dict, str]:
+    """Load cookies for a domain from the first available browser in order.
+
+    Browsers given explicitly are tried one at a time. For the default list
+    the first browser is tried alone; only if it fails are the rest probed
+    concurrently (each probe is mostly keyring IPC and SQLite I/O), with
+    results still taken in DEFAULT_BROWSERS order so the choice does not
+    depend on which browser answers first.
+
+    allow limits the result to cookies whose name starts with one of the given
+    prefixes, so the jar isn't copied wholesale and less ends up cached.
+
+    With cache_ttl > 0, the result is kept in memory and under
+    $XDG_RUNTIME_DIR for that many seconds so repeated calls and runs skip
+    the keyring decrypt. A result missing any of the required name prefixes
+    (e.g. a logged-out browser) is returned but not cached, so the next call
+    reads the browser again. Callers that opt in should call
+    invalidate_cookie_cache() when the cookies are rejected.
+    """
+    if cache_ttl > 0:
+        browsers = list(browsers or ())
+        # Long-running callers (ai-usage --daemon) hit this first
+        memo = _COOKIE_MEMO.get(domain)
+        if memo and time.time() - memo[0] < cache_ttl and (not browsers or memo[2] in browsers):
+            return memo[1], memo[2]
+        cached = _read_cookie_cache(domain, browsers, cache_ttl)
+        if cached is not None:
+            return cached
+        cookies, browser = load_cookies(domain, browsers, allow=allow)
+        if all(any(name.startswith(prefix) for name in cookies) for prefix in required):
+            _write_cookie_cache(domain, cookies, browser)
+            _COOKIE_MEMO[domain] = (time.time(), cookies, browser)
+        return cookies, browser
+
+    names = list(browsers or DEFAULT_BROWSERS)
+    allow = tuple(allow) if allow is not None else None
+    errors: list[str] = []
+
+    if browsers:
+        for name in names:
+            try:
+                return _probe_browser(name, domain, allow), name
+            except Exception as exc:
+                errors.append(f"{name}: {exc}")
+    elif names:
+        try:
+            return _probe_browser(names[0], domain, allow), names[0]
+        except Exception as exc:
+            errors.append(f"{names[0]}: {exc}")
 
-        errors.append(f"{name}: no cookies found")
+        futures = [_probe_in_background(name, domain, allow) for name in names[1:]]
+        for name, future in zip(names[1:], futures):
+            try:
+                return future.result(), name
+            except Exception as exc:
+                errors.append(f"{name}: {exc}")
 
     detail = "; ".join(errors) if errors else "no browsers provided"
     raise RuntimeError(f"Failed to read cookies for {domain}: {detail}")
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class WindowUsage:
     """Usage information for a time window."""
     utilization: float
     resets_at: Optional[str | int]
+    utilization_pct: int  # utilization rounded for display
 
 
 def parse_window_percent(raw: Mapping[str, object] | None, key: str = "utilization") -> WindowUsage:
@@ -236,7 +470,11 @@ def parse_window_percent(raw: Mapping[str, object] | None, key: str = "utilizati
     except Exception:
         util_f = 0.0
 
-    return WindowUsage(utilization=util_f, resets_at=resets)  # type: ignore[arg-type]
+    return WindowUsage(
+        utilization=util_f,
+        resets_at=resets,  # type: ignore[arg-type]
+        utilization_pct=int(round(util_f)),
+    )
 
 
 def parse_window_direct(raw: Mapping[str, object] | None) -> WindowUsage:
@@ -250,29 +488,56 @@ def parse_window_direct(raw: Mapping[str, object] | None) -> WindowUsage:
     except Exception:
         used_f = 0.0
 
-    return WindowUsage(utilization=used_f, resets_at=reset_at)  # type: ignore[arg-type]
+    return WindowUsage(
+        utilization=used_f,
+        resets_at=reset_at,  # type: ignore[arg-type]
+        utilization_pct=int(round(used_f)),
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_iso_timestamp(reset_at: str) -> float:
+    """Parse an ISO 8601 string to a Unix timestamp (naive values are UTC).
+
+    Cached because one render formats the same reset strings several times.
+    Python 3.11's C fromisoformat accepts Claude's trailing 'Z' directly and
+    outperforms a hand-rolled slice parser, so no pre-processing is done.
+    """
+    from datetime import datetime, timezone
+
+    reset_dt = datetime.fromisoformat(reset_at)
+    if reset_dt.tzinfo is None:
+        reset_dt = reset_dt.replace(tzinfo=timezone.utc)
+    return reset_dt.timestamp()
+
+
+def _reset_timestamp(reset_at: str | int) -> float:
+    """Unix timestamp for an ISO string or numeric reset time; raises if unparsable."""
+    if isinstance(reset_at, str):
+        return _parse_iso_timestamp(reset_at)
+    return float(reset_at)
 
 
 def format_eta(reset_at: str | int | None) -> str:
     """Format ETA from ISO string or Unix timestamp -> '4h19′' or '19′30″'."""
+    return format_eta_with_seconds(reset_at)[0]
+
+
+def format_eta_with_seconds(reset_at: str | int | None) -> tuple[str, int | None]:
+    """Like format_eta, but also return the seconds left (None if unset or unparsable)."""
     if not reset_at:
-        return "0′00″"
+        return "0′00″", None
 
     try:
-        # Handle both ISO string and Unix timestamp
-        if isinstance(reset_at, str):
-            if reset_at.endswith('Z'):
-                reset_at = reset_at[:-1] + '+00:00'
-            reset_dt = datetime.fromisoformat(reset_at)
-        else:
-            reset_dt = datetime.fromtimestamp(reset_at, tz=timezone.utc)
-
-        now = datetime.now(timezone.utc)
-        delta = reset_dt - now
+        reset_ts = _reset_timestamp(reset_at)
     except Exception:
-        return "??′??″"
+        return "??′??″", None
+
+    secs = int(reset_ts - time.time())
+    return _format_duration(secs), secs
 
-    secs = int(delta.total_seconds())
+
+def _format_duration(secs: int) -> str:
     if secs <= 0:
         return "0m00s"
 
@@ -294,6 +559,65 @@ def format_eta(reset_at: str | int | None) -> str:
     return f"{mins}m{secs_rem:02}s"
 
 
+@dataclass(slots=True, frozen=True)
+class WindowDetail:
+    """A usage window plus the values print_waybar derives from it."""
+    utilization: float
+    utilization_pct: int
+    resets_at: Optional[str | int]
+    reset_str: str
+    window_length: int
+    seconds_to_reset: Optional[int]
+    is_unused: bool
+
+
+def parse_window_full(
+    raw: Mapping[str, object] | None,
+    window_length_default: int,
+    parse: Callable[[Mapping[str, object] | None], WindowUsage] = parse_window_percent,
+    derive_remaining: bool = True,
+) -> WindowDetail:
+    """Parse a window and precompute its reset string and unused state in one pass.
+
+    `parse` picks the provider's field layout (parse_window_percent for Claude,
+    parse_window_direct for ChatGPT). resets_at is parsed once, yielding both
+    reset_str and seconds_to_reset. ChatGPT's limit_window_seconds and
+    reset_after_seconds take precedence when present; with
+    derive_remaining=False, seconds_to_reset comes only from
+    reset_after_seconds, so a window without it is never reported as unused.
+    """
+    raw = raw or {}
+    win = parse(raw)
+
+    window_length = raw.get("limit_window_seconds") or window_length_default
+    if win.resets_at:
+        reset_str, seconds_to_reset = format_eta_with_seconds(win.resets_at)
+    else:
+        reset_str, seconds_to_reset = "Not started", None
+    # ChatGPT also reports the remaining time directly; prefer it
+    if raw.get("reset_after_seconds") is not None:
+        seconds_to_reset = raw["reset_after_seconds"]
+    elif not derive_remaining:
+        seconds_to_reset = None
+
+    # Untouched window: nothing used and the reset is a full window away (allow 1s error)
+    is_unused = (
+        win.utilization == 0
+        and seconds_to_reset is not None
+        and seconds_to_reset >= window_length - 1
+    )
+
+    return WindowDetail(
+        utilization=win.utilization,
+        utilization_pct=win.utilization_pct,
+        resets_at=win.resets_at,
+        reset_str=reset_str,
+        window_length=window_length,  # type: ignore[arg-type]
+        seconds_to_reset=seconds_to_reset,  # type: ignore[arg-type]
+        is_unused=is_unused,
+    )
+
+
 def format_output(format_string: str, data: dict) -> str:
     """
     Format output using a template string with placeholders.
@@ -318,8 +642,10 @@ def format_output(format_string: str, data: dict) -> str:
         format_output("{icon} {5h_pct}% {time_icon} {5h_reset}", data)
         format_output("{?5h_reset}{5h_pct}/{5h_reset}{/5h_reset}{?5h_reset&7d_reset} - {/}{?7d_reset}{7d_pct}/{7d_reset}{/7d_reset}", data)
     """
-    import re
-    
+    # Plain templates need no conditional processing
+    if '{?' not in format_string:
+        return format_string.format_map(data)
+
     # Process conditional blocks with multiple variables: {?var1&var2&...}content{/}
     def replace_multi_conditional(match):
         var_names = match.group(1).split('&')
@@ -327,11 +653,11 @@ def format_output(format_string: str, data: dict) -> str:
         # Check if all variables exist and are not "Not started"
         all_valid = all(data.get(v.strip(), "") and data.get(v.strip(), "") != "Not started" for v in var_names)
         if all_valid:
-            return content.format(**data)
+            return content.format_map(data)
         return ""
     
     # Replace multi-variable conditional blocks first: {?var1&var2}content{/}
-    result = re.sub(r'\{\?([^}]+&[^}]+)\}(.*?)\{/\}', replace_multi_conditional, format_string)
+    result = _MULTI_COND_RE.sub(replace_multi_conditional, format_string)
     
     # Process single variable conditional blocks: {?var}content{/var}
     def replace_conditional(match):
@@ -340,11 +666,11 @@ def format_output(format_string: str, data: dict) -> str:
         value = data.get(var_name, "")
         # Show content only if value exists and is not "Not started"
         if value and value != "Not started":
-            return content.format(**data)
+            return content.format_map(data)
         return ""
     
     # Replace single-variable conditional blocks: {?var}content{/var}
-    result = re.sub(r'\{\?(\w+)\}(.*?)\{/\1\}', replace_conditional, result)
+    result = _SINGLE_COND_RE.sub(replace_conditional, result)
     
     # Replace remaining placeholders
-    return result.format(**data)
+    return result.format_map(data)
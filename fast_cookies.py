@@ -0,0 +1,96 @@
+"""Narrow cookie reader for Chromium-based browsers.
+
+browser_cookie3 decrypts every cookie stored for a host. The usage widgets
+only need a handful of them, so this module asks the browser's Cookies
+database for just those rows and decrypts only what comes back.
+
+Key retrieval and cookie-file discovery are still done by browser_cookie3,
+so behaviour matches its loaders. If the narrow query or decrypt fails for
+any reason (unreadable database, schema change, private API moved), the full
+browser_cookie3 load is used instead.
+"""
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+
+
+# Browser name -> browser_cookie3 class (Helium is Chromium with its own cookie file)
+CHROMIUM_BROWSERS = {
+    "chrome": "Chrome",
+    "chromium": "Chromium",
+    "brave": "Brave",
+    "edge": "Edge",
+    "helium": "Chromium",
+}
+
+
+def _connect_readonly(cookie_file: str) -> sqlite3.Connection:
+    """Open the Cookies DB read-only, even while the browser holds its lock.
+
+    A running Chromium keeps the database exclusively locked, so a plain
+    mode=ro open fails with "database is locked". Same fallback order as
+    browser_cookie3's own connection helper.
+    """
+    uri = Path(cookie_file).absolute().as_uri()
+    for options in ("?mode=ro", "?mode=ro&nolock=1", "?mode=ro&immutable=1"):
+        try:
+            con = sqlite3.connect(uri + options, uri=True)
+        except sqlite3.OperationalError:
+            continue
+        try:
+            con.execute("SELECT 1 FROM sqlite_master")
+        except sqlite3.OperationalError:
+            con.close()
+            continue
+        return con
+    raise sqlite3.OperationalError(f"Unable to open {cookie_file} read-only")
+
+
+def _query_cookies(browser, domain: str, allow: tuple[str, ...]) -> dict:
+    """Select and decrypt only the allowed cookie names for domain."""
+    # Prefix match via substr() since cookie names contain LIKE wildcards ('_')
+    name_filter = " OR ".join("substr(name, 1, ?) = ?" for _ in allow)
+    params: list[object] = [f"%{domain}%"]
+    for prefix in allow:
+        params += [len(prefix), prefix]
+
+    con = _connect_readonly(browser.cookie_file)
+    try:
+        has_integrity_check = browser._has_integrity_check_for_cookie_domain(con)
+        rows = con.execute(
+            "SELECT name, value, encrypted_value FROM cookies "
+            f"WHERE host_key LIKE ? AND ({name_filter})",
+            params,
+        ).fetchall()
+    finally:
+        con.close()
+
+    return {
+        name: browser._decrypt(value, encrypted_value, has_integrity_check)
+        for name, value, encrypted_value in rows
+    }
+
+
+def load_chromium_cookies(
+    name: str,
+    domain: str,
+    allow: Iterable[str],
+    cookie_file: str | None = None,
+) -> dict:
+    """Load allowed cookies for domain from a Chromium-based browser.
+
+    Errors from locating the browser or its key are raised as-is; they would
+    fail the same way through browser_cookie3's own loader.
+    """
+    import browser_cookie3
+
+    browser_cls = getattr(browser_cookie3, CHROMIUM_BROWSERS[name])
+    browser = browser_cls(cookie_file=cookie_file, domain_name=domain)
+
+    allow = tuple(allow)
+    try:
+        return _query_cookies(browser, domain, allow)
+    except Exception:
+        return {c.name: c.value for c in browser.load() if c.name.startswith(allow)}